@@ -1,3 +1,4 @@
+import bisect
 import re
 
 class SymbolGraphBuilder:
@@ -13,6 +14,9 @@ class SymbolGraphBuilder:
         # Handles indentation (methods) and async def
         pattern = re.compile(r'^\s*(async\s+)?(def|class)\s+([a-zA-Z_][a-zA-Z0-9_]*)', re.MULTILINE)
         
+        # Sorted newline offsets so each line lookup is O(log n)
+        nl_positions = [m.start() for m in re.finditer(r'\n', code)]
+        
         for m in pattern.finditer(code):
             is_async = m.group(1) is not None
             keyword = m.group(2)
@@ -21,7 +25,7 @@ class SymbolGraphBuilder:
             symbols.append({
                 "name": name,
                 "type": "function" if keyword == "def" else "class",
-                "line": code.count('\n', 0, m.start()) + 1
+                "line": bisect.bisect_right(nl_positions, m.start()) + 1
             })
             
         return symbols
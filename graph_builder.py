@@ -1,78 +1,268 @@
+import bisect
+import hashlib
+import re
+from array import array
+from functools import partial
+from typing import TYPE_CHECKING
+
+import numpy as np
 import tree_sitter
 from tree_sitter_language_pack import get_language, get_parser
-import networkx as nx
-import matplotlib.pyplot as plt
-from collections import defaultdict
+
+# networkx and matplotlib are only needed for graph building/plotting, which the
+# indexer never does, so they're imported inside the methods that use them
+if TYPE_CHECKING:
+    import networkx as nx
+
+# Above this many nodes, networkit's sampling estimator replaces exact betweenness
+APPROX_BETWEENNESS_NODES = 10_000
+
+# google-re2 compiles patterns to a DFA and scans in linear time; the two
+# whole-file scanners use it when installed and fall back to `re` otherwise.
+# Flags are written inline so the same pattern strings work with both engines.
+try:
+    import re2 as _scan_re
+except ImportError:
+    _scan_re = re
+
+# Matches 'def name' / 'async def name' / 'class Name' at any indentation.
+# Compiled once over bytes so files can be scanned without decoding them.
+_SYM_RE = _scan_re.compile(
+    rb"(?m)^[ \t]*(?:async[ \t]+)?(def|class)[ \t]+([A-Za-z_]\w*)"
+)
+_TS_SYMBOL_QUERY = """
+    (function_definition name: (identifier) @name)
+    (class_definition name: (identifier) @name)
+"""
+_NL_RE = re.compile(rb"\n")
+_NL_STR_RE = re.compile(r"\n")
+
+# All resource usage patterns fused into one alternation; the matched group name
+# is the resource type. Whole comment lines are consumed first so nothing inside
+# them can match. Case-insensitive matching replaces lowercasing every line.
+_RESOURCE_RE = _scan_re.compile(
+    r"(?im)(?P<comment>^[ \t]*#[^\n]*)"
+    # File operations
+    r"|\.open[ \t]*\([ \t]*['\"](?P<file>[^'\"\n]+)['\"]"
+    # Database connections
+    r"|(?P<database>connect|connection|cursor|execute|query)"
+    # HTTP requests
+    r"|(?P<http>(?:get|post|put|delete|request)[ \t]*\()"
+    # Variables with suspicious names
+    r"|\b(?P<config>config|settings|resource|data_|input_|output_)\w*"
+)
+_PARAMS_RE = re.compile(r"\((.*?)\)")
 
 
 class SymbolGraphBuilder:
-    def __init__(self, lang_name="python"):
-        self.language = get_language(lang_name)
-        self.parser = get_parser(lang_name)
-        # Map of resource name to operations that use it
-        self.resource_dependencies = defaultdict(set)
-        # Map of operation to resources it depends on
-        self.operation_resources = defaultdict(set)
-
-    def parse_symbols(self, code):
-        tree = self.parser.parse(bytes(code, "utf8"))
-
-        query = self.language.query("""
-            (function_definition name: (identifier) @name)
-            (class_definition name: (identifier) @name)
-        """)
+    def __init__(self, lang_name="python", use_treesitter=False):
+        # The regex scanner only understands Python; other languages need real ASTs
+        self.use_treesitter = use_treesitter or lang_name != "python"
+        if self.use_treesitter:
+            self.language = get_language(lang_name)
+            self.parser = get_parser(lang_name)
+            try:
+                self._query = tree_sitter.Query(self.language, _TS_SYMBOL_QUERY)
+            except TypeError:
+                # 0.21 style: queries are built from the Language
+                self._query = self.language.query(_TS_SYMBOL_QUERY)
+            self._capture, self._captures_are_dict = self._resolve_capture()
+        # path -> (content hash, Tree) so repeated parses can reuse subtrees
+        self._tree_cache: dict[str, tuple[bytes, tree_sitter.Tree]] = {}
+        # Operation and resource names interned to integer IDs
+        self._name_to_id: dict[str, int] = {}
+        self._id_to_name: list[str] = []
+        # IDs of every extracted operation, including ones with no resources
+        self._op_ids = array("i")
+        # "uses" edges as parallel arrays: _op_edges[i] uses _res_edges[i]
+        self._op_edges = array("i")
+        self._res_edges = array("i")
+
+    def _intern(self, name):
+        """Return the integer ID for name, assigning the next one if new."""
+        name_id = self._name_to_id.get(name)
+        if name_id is None:
+            name_id = len(self._id_to_name)
+            self._name_to_id[name] = name_id
+            self._id_to_name.append(name)
+        return name_id
+
+    @property
+    def resource_dependencies(self):
+        """Map of resource name to the set of operations that use it."""
+        names = self._id_to_name
+        deps = {}
+        for op_id, res_id in zip(self._op_edges, self._res_edges):
+            deps.setdefault(names[res_id], set()).add(names[op_id])
+        return deps
+
+    @property
+    def operation_resources(self):
+        """Map of operation name to the set of resources it depends on."""
+        names = self._id_to_name
+        ops = {names[op_id]: set() for op_id in self._op_ids}
+        for op_id, res_id in zip(self._op_edges, self._res_edges):
+            ops[names[op_id]].add(names[res_id])
+        return ops
+
+    def parse_symbols(self, code, path=None, old_code=None):
+        """
+        Extract function and class definitions from source code.
+
+        Args:
+            code: Source code as str or raw bytes
+            path: Optional file path used as the tree-sitter cache key
+            old_code: Optional previous contents of path, enabling an
+                incremental reparse against the cached tree
+
+        Returns:
+            List of {"name", "type", "line"} dicts in source order
+        """
+        if isinstance(code, str):
+            code = code.encode("utf8")
+        if self.use_treesitter:
+            return self._parse_symbols_treesitter(code, path, old_code)
+
+        # Sorted newline offsets: each line lookup is a bisect, not a rescan
+        nl_positions = [m.start() for m in _NL_RE.finditer(code)]
 
         symbols = []
+        for m in _SYM_RE.finditer(code):
+            symbols.append(
+                {
+                    "name": m.group(2).decode("ascii"),
+                    "type": "function" if m.group(1) == b"def" else "class",
+                    "line": bisect.bisect_right(nl_positions, m.start()) + 1,
+                }
+            )
+        return symbols
 
-        # STRATEGY: Try passing query to constructor (0.23 style)
-        # If that fails (TypeError), try empty constructor (0.21/0.25 style)
-        try:
-            # Try 0.23 style: Cursor is bound to a specific query
-            cursor = tree_sitter.QueryCursor(query)
-
-            # In this version, captures/matches usually take just the node
-            # matches() -> iterator of matches
-            # captures() -> iterator of (Node, str)
-            if hasattr(cursor, "captures"):
-                results = cursor.captures(tree.root_node)
+    def _parse_tree(self, code, path=None, old_code=None):
+        """
+        Parse code with tree-sitter, reusing the cached tree for path if possible.
+
+        Args:
+            code: Source bytes to parse
+            path: Cache key; without it every call is a full parse
+            old_code: Previous contents of path, used to describe the edit
+
+        Returns:
+            tree_sitter.Tree for code
+        """
+        if path is None:
+            return self.parser.parse(code)
+
+        code_hash = hashlib.blake2b(code, digest_size=16).digest()
+        cached = self._tree_cache.get(path)
+
+        if cached is not None and cached[0] == code_hash:
+            # Unchanged file: nothing to parse
+            return cached[1]
+
+        if cached is not None and old_code is not None:
+            if isinstance(old_code, str):
+                old_code = old_code.encode("utf8")
+            old_hash = hashlib.blake2b(old_code, digest_size=16).digest()
+            if cached[0] == old_hash:
+                old_tree = cached[1]
+                self._apply_edit(old_tree, old_code, code)
+                tree = self.parser.parse(code, old_tree)
+                self._tree_cache[path] = (code_hash, tree)
+                return tree
+
+        # Cache miss (or stale old_code): full parse
+        tree = self.parser.parse(code)
+        self._tree_cache[path] = (code_hash, tree)
+        return tree
+
+    @staticmethod
+    def _apply_edit(tree, old_code, new_code):
+        """Describe old_code -> new_code to tree as a single edited byte range."""
+        # Binary search on slice equality keeps the byte comparisons in C;
+        # memoryviews make the slices free
+        old_view, new_view = memoryview(old_code), memoryview(new_code)
+        old_len, new_len = len(old_code), len(new_code)
+
+        # Length of the common prefix
+        lo, hi = 0, min(old_len, new_len)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if old_view[:mid] == new_view[:mid]:
+                lo = mid
             else:
-                # Some versions use execute() or similar, but let's try matches fallback
-                results = []  # Fallback
-
-        except TypeError:
-            # Fallback to 0.21/0.25 style: Cursor is reusable
-            cursor = tree_sitter.QueryCursor()
-            # Then we pass query to the method
-            results = cursor.captures(query, tree.root_node)
-
-        # Process whatever results we got (assuming they are iterable of (Node, index/name))
-        # Note: 'results' might be different formats, so we inspect robustly
-
-        if not results and hasattr(query, "captures"):
-            # Last resort: 0.21 legacy style on Query object
-            results = query.captures(tree.root_node)
-
-        # Iterate safely
-        for item in results:
-            # Item structure varies: (Node, str) or (Node, int) or Match object
-            node = None
-            tag = "unknown"
-
-            if isinstance(item, tuple) and len(item) == 2:
-                node, tag = item
-            elif hasattr(item, "node"):
-                node = item.node  # If it's a dedicated Capture object
-
-            if node:
-                symbols.append(
-                    {
-                        "name": node.text.decode("utf8"),
-                        "type": "function"
-                        if "function" in node.parent.type
-                        else "class",
-                        "line": node.start_point[0] + 1,
-                    }
-                )
+                hi = mid - 1
+        start = lo
+
+        # Length of the common suffix, without crossing start
+        lo, hi = 0, min(old_len, new_len) - start
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if old_view[old_len - mid:] == new_view[new_len - mid:]:
+                lo = mid
+            else:
+                hi = mid - 1
+        old_end, new_end = old_len - lo, new_len - lo
+
+        def point(buf, offset):
+            row = buf.count(b"\n", 0, offset)
+            return (row, offset - (buf.rfind(b"\n", 0, offset) + 1))
+
+        tree.edit(
+            start_byte=start,
+            old_end_byte=old_end,
+            new_end_byte=new_end,
+            start_point=point(old_code, start),
+            old_end_point=point(old_code, old_end),
+            new_end_point=point(new_code, new_end),
+        )
+
+    def _resolve_capture(self):
+        """
+        Pick the capture call matching the installed tree-sitter API.
+
+        Probed once against an empty tree so parsing never pays for the
+        try/except and hasattr checks.
+
+        Returns:
+            Tuple of (capture callable taking a root node, whether it returns
+            a {capture_name: [Node]} dict rather than (Node, tag) pairs)
+        """
+        root = self.parser.parse(b"").root_node
+        if hasattr(tree_sitter, "QueryCursor"):
+            try:
+                # 0.23+ style: Cursor is bound to a specific query
+                capture = tree_sitter.QueryCursor(self._query).captures
+                probe = capture(root)
+            except TypeError:
+                # 0.22 style: Cursor is reusable, query passed per call
+                capture = partial(tree_sitter.QueryCursor().captures, self._query)
+                probe = capture(root)
+        else:
+            # 0.21 legacy style on Query object
+            capture = self._query.captures
+            probe = capture(root)
+        return capture, isinstance(probe, dict)
+
+    def _parse_symbols_treesitter(self, code, path=None, old_code=None):
+        tree = self._parse_tree(code, path, old_code)
+
+        results = self._capture(tree.root_node)
+        if self._captures_are_dict:
+            nodes = [node for group in results.values() for node in group]
+        else:
+            nodes = [item[0] for item in results]
+
+        symbols = []
+        for node in nodes:
+            symbols.append(
+                {
+                    "name": node.text.decode("utf8"),
+                    "type": "function" if "function" in node.parent.type else "class",
+                    "line": node.start_point[0] + 1,
+                }
+            )
+        # Dict-style results group by capture name; keep source order
+        symbols.sort(key=lambda sym: sym["line"])
 
         return symbols
 
@@ -88,90 +278,68 @@ class SymbolGraphBuilder:
             Tuple of (resource_deps, op_resources)
         """
         # Clear previous mappings
-        self.resource_dependencies.clear()
-        self.operation_resources.clear()
-
-        # In Python, look for function parameters and their usage
-        for symbol in symbols:
+        self._name_to_id.clear()
+        self._id_to_name.clear()
+        del self._op_ids[:], self._op_edges[:], self._res_edges[:]
+
+        if isinstance(code, bytes):
+            code = code.decode("utf8", errors="replace")
+        lines = code.split("\n")
+
+        # Every def/class line ends the body of the function before it, so a
+        # match belongs to the nearest symbol starting at or above its line
+        ordered = sorted(symbols, key=lambda sym: sym["line"])
+        starts = [sym["line"] - 1 for sym in ordered]
+        func_resources = {}
+        for idx, symbol in enumerate(ordered):
             if symbol["type"] == "function":
-                func_name = symbol["name"]
-                lines = code.split("\n")
-
-                # Get function body (simplified approach)
-                start_line = symbol["line"] - 1
-                end_line = len(lines)
-
-                # Look for next function or class definition to determine end
-                for i in range(start_line + 1, end_line):
-                    line = lines[i].strip()
-                    if line.startswith(("def ", "class ", "async def ")):
-                        end_line = i
-                        break
-
-                func_body = "\n".join(lines[start_line:end_line])
-
-                # Extract potential resources from function signature and body
-                resources = self._extract_resources_from_function(func_body)
-
-                # Map the operation to its resources
-                self.operation_resources[func_name] = resources
-
-                # Map each resource to the operation
-                for resource in resources:
-                    self.resource_dependencies[resource].add(func_name)
-
-        return dict(self.resource_dependencies), dict(self.operation_resources)
+                # Extract parameters from function signature
+                func_resources[idx] = self._extract_function_params(
+                    lines[starts[idx]]
+                )
 
-    def _extract_resources_from_function(self, func_code):
+        # One pass over the whole file, assigning each match to its function
+        nl_positions = [m.start() for m in _NL_STR_RE.finditer(code)]
+        for m in _RESOURCE_RE.finditer(code):
+            line = bisect.bisect_right(nl_positions, m.start())
+            idx = bisect.bisect_right(starts, line) - 1
+            if idx in func_resources:
+                self._add_resource(func_resources[idx], m)
+
+        # Functions sharing a name are one operation; as before, the last
+        # definition in the file wins (dicts keep the last value per key)
+        merged = {}
+        for idx, resources in func_resources.items():
+            merged[ordered[idx]["name"]] = resources
+
+        # Record one "uses" edge per distinct (operation, resource) pair
+        for func_name, resources in merged.items():
+            op_id = self._intern(func_name)
+            self._op_ids.append(op_id)
+            for resource in resources:
+                self._op_edges.append(op_id)
+                self._res_edges.append(self._intern(resource))
+
+        return self.resource_dependencies, self.operation_resources
+
+    def _add_resource(self, resources, m):
         """
-        Extract resource names from a function code.
+        Record the resource named by a _RESOURCE_RE match.
 
         Args:
-            func_code: The function's source code
-
-        Returns:
-            Set of resource names
+            resources: Set of resource names to update
+            m: Match object from _RESOURCE_RE
         """
-        resources = set()
-        lines = func_code.split("\n")
-
-        # Look for function definition line
-        for line in lines:
-            if line.strip().startswith(("def ", "async def ")):
-                # Extract parameters from function signature
-                params = self._extract_function_params(line)
-                resources.update(params)
-
-        # Look for common resource usage patterns
-        resource_patterns = [
-            # File operations
-            (r'\.open\s*\(\s*[\'"]([^\'"]+)[\'"]', "file"),
-            # Database connections
-            (r"(connect|connection|cursor|execute|query)", "database"),
-            # HTTP requests
-            (r"(get|post|put|delete|request)\s*\(", "http"),
-            # Variables with可疑 names
-            (r"\b(config|settings|resource|data_|input_|output_)\w*", "config"),
-        ]
-
-        for line in lines:
-            # Skip comments
-            if line.strip().startswith("#"):
-                continue
-
-            for pattern, resource_type in resource_patterns:
-                import re
-
-                matches = re.findall(pattern, line.lower())
-                if matches:
-                    if resource_type in ("file", "config"):
-                        # Extract actual names
-                        resources.update(matches)
-                    else:
-                        # Use type as resource identifier
-                        resources.add(f"{resource_type}_{len(resources)}")
-
-        return resources
+        resource_type = m.lastgroup
+        if resource_type == "comment":
+            return
+        if resource_type in ("file", "config"):
+            # Extract actual names
+            resources.add(m.group(resource_type).lower())
+        else:
+            # Use type as resource identifier, so every function touching a
+            # database (or making HTTP calls) shares one node
+            resources.add(resource_type)
 
     def _extract_function_params(self, func_def_line):
         """
@@ -186,9 +354,7 @@ class SymbolGraphBuilder:
         params = set()
 
         # Find parameters between parentheses
-        import re
-
-        match = re.search(r"\((.*?)\)", func_def_line)
+        match = _PARAMS_RE.search(func_def_line)
         if match:
             param_str = match.group(1)
             # Split and clean parameter names
@@ -201,29 +367,69 @@ class SymbolGraphBuilder:
 
         return params
 
-    def build_dependency_graph(self):
+    def build_dependency_graph(self) -> "nx.DiGraph":
         """
         Build a NetworkX graph representing resource dependencies.
 
         Returns:
             NetworkX DiGraph object
         """
+        import networkx as nx
+
         G = nx.DiGraph()
+        names = self._id_to_name
 
         # Add nodes for operations
-        for op_name in self.operation_resources:
-            G.add_node(op_name, type="operation")
+        G.add_nodes_from(
+            (names[op_id], {"type": "operation"}) for op_id in self._op_ids
+        )
+
+        # Add nodes for resources, each once
+        res_ids = dict.fromkeys(self._res_edges)
+        G.add_nodes_from((names[res_id], {"type": "resource"}) for res_id in res_ids)
 
-        # Add nodes for resources and edges for dependencies
-        for resource, operations in self.resource_dependencies.items():
-            # Add resource node
-            G.add_node(resource, type="resource")
-            # Add edges from operations to resources
-            for op in operations:
-                G.add_edge(op, resource, relation="uses")
+        # Add edges from operations to resources
+        G.add_edges_from(
+            (names[op_id], names[res_id], {"relation": "uses"})
+            for op_id, res_id in zip(self._op_edges, self._res_edges)
+        )
 
         return G
 
+    def betweenness_centrality(self, G=None):
+        """
+        Compute normalized betweenness centrality for the dependency graph.
+
+        Uses networkit's parallel C++ implementation when it is installed
+        (approximate above APPROX_BETWEENNESS_NODES nodes), and NetworkX
+        otherwise.
+
+        Args:
+            G: Optional graph from build_dependency_graph; built if omitted
+
+        Returns:
+            Dictionary mapping node name to centrality score
+        """
+        if G is None:
+            G = self.build_dependency_graph()
+        if G.number_of_nodes() == 0:
+            return {}
+
+        try:
+            import networkit as nk
+        except ImportError:
+            import networkx as nx
+
+            return nx.betweenness_centrality(G)
+
+        nk_graph = nk.nxadapter.nx2nk(G)
+        if G.number_of_nodes() > APPROX_BETWEENNESS_NODES:
+            algo = nk.centrality.ApproxBetweenness(nk_graph, epsilon=0.05)
+        else:
+            algo = nk.centrality.Betweenness(nk_graph, normalized=True)
+        # nx2nk numbers nodes 0..n-1 in G.nodes() order
+        return dict(zip(G.nodes(), algo.run().scores()))
+
     def visualize_graph(self, output_file=None):
         """
         Visualize the dependency graph using matplotlib.
@@ -231,6 +437,9 @@ class SymbolGraphBuilder:
         Args:
             output_file: Optional file path to save the visualization
         """
+        import matplotlib.pyplot as plt
+        import networkx as nx
+
         G = self.build_dependency_graph()
 
         plt.figure(figsize=(12, 8))
@@ -268,44 +477,52 @@ class SymbolGraphBuilder:
             plt.savefig(output_file, dpi=300, bbox_inches="tight")
         plt.show()
 
+    def analyze_dependencies(self):
+        """
+        Analyze and return dependency insights.
 
-def analyze_dependencies(self):
-    """
-    Analyze and return dependency insights.
-
-    Returns:
-        Dictionary with dependency statistics and insights
-    """
-    insights = {
-        "total_operations": len(self.operation_resources),
-        "total_resources": len(self.resource_dependencies),
-        "resource_usage": {},
-        "operation_dependencies": {},
-        "shared_resources": {},
-        "critical_resources": [],
-    }
-
-    # Resource usage frequency
-    for resource, operations in self.resource_dependencies.items():
-        insights["resource_usage"][resource] = len(operations)
+        Returns:
+            Dictionary with dependency statistics and insights
+        """
+        names = self._id_to_name
+        op_edges = np.frombuffer(self._op_edges, dtype=np.intc)
+        res_edges = np.frombuffer(self._res_edges, dtype=np.intc)
+
+        # Edges are distinct (operation, resource) pairs, so per-ID edge counts are
+        # the number of operations per resource and resources per operation
+        res_counts = np.bincount(res_edges, minlength=len(names))
+        op_counts = np.bincount(op_edges, minlength=len(names))
+        res_ids = np.unique(res_edges)
+
+        insights = {
+            "total_operations": len(self._op_ids),
+            "total_resources": len(res_ids),
+            "resource_usage": {},
+            "operation_dependencies": {},
+            "shared_resources": {},
+            "critical_resources": [],
+        }
+
+        # Resource usage frequency
+        for res_id in res_ids.tolist():
+            insights["resource_usage"][names[res_id]] = int(res_counts[res_id])
 
         # Find shared resources (used by multiple operations)
-        if len(operations) > 1:
-            insights["shared_resources"][resource] = list(operations)
-
-    # Operation dependencies (how many resources each operation needs)
-    for operation, resources in self.operation_resources.items():
-        insights["operation_dependencies"][operation] = len(resources)
-
-    # Critical resources (used by most operations)
-    if insights["total_resources"] > 0 and insights["resource_usage"]:
-        avg_usage = sum(insights["resource_usage"].values()) / len(
-            insights["resource_usage"]
-        )
-        insights["critical_resources"] = [
-            r
-            for r, count in insights["resource_usage"].items()
-            if isinstance(count, int) and count > avg_usage * 1.5
-        ]
-
-    return insights
+        shared = res_ids[res_counts[res_ids] > 1]
+        if len(shared):
+            deps = self.resource_dependencies
+            for res_id in shared.tolist():
+                name = names[res_id]
+                insights["shared_resources"][name] = list(deps[name])
+
+        # Operation dependencies (how many resources each operation needs)
+        for op_id in self._op_ids:
+            insights["operation_dependencies"][names[op_id]] = int(op_counts[op_id])
+
+        # Critical resources (used by most operations)
+        if len(res_ids):
+            usage = res_counts[res_ids]
+            critical = res_ids[usage > usage.mean() * 1.5]
+            insights["critical_resources"] = [names[r] for r in critical.tolist()]
+
+        return insights
@@ -1,12 +1,243 @@
+import hashlib
+import math
 import os
-import lancedb
+import queue
+import sqlite3
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import lancedb
+import numpy as np
+import pyarrow as pa
+
 from graph_builder import SymbolGraphBuilder
 from mlx_engine import DreamsMLXEngine
 
 # CONFIG
 DB_PATH = "./dreams_memory"
 TARGET_DIR = "."  # Index the current directory
+CHUNK_LINES = 30  # Lines of context embedded per symbol
+MIN_CHUNK_BYTES = 40  # Smaller chunks (empty __init__.py, bare stubs) aren't indexed
+EMBED_BATCH_SIZE = 256  # Chunks buffered before a single GPU encode call
+EMBED_MIN_BATCH = 64  # Flush early at this size if readers fall behind the GPU
+READ_WORKERS = 8  # Threads reading + parsing files ahead of the GPU
+READ_AHEAD = READ_WORKERS * 4  # Max files submitted to the readers at once
+QUEUE_SIZE = 512  # Max chunks waiting between readers and the GPU
+CACHE_FILE = "emb_cache.sqlite"  # Lives next to the LanceDB tables in DB_PATH
+SKIP_DIRS = {"venv", ".venv", "__pycache__", ".git"}
+VECTOR_DTYPE = np.float16  # Stored precision; the cache keeps full float32
+FLAT_SEARCH_MAX = 10_000  # Below this, exact flat search beats any ANN index
+HNSW_MAX = 100_000  # Up to this, IVF_HNSW_SQ; above it, IVF_PQ
+# e.g. "mps" to train IVF k-means on GPU (needs pylance + torch)
+INDEX_ACCELERATOR = None
+
+
+def _iter_py(root):
+    """Yield paths of .py files under root, pruning SKIP_DIRS by entry name"""
+    stack = [root]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            # Unreadable directory: skip it, as os.walk did
+            continue
+        with it:
+            for entry in it:
+                # scandir already knows the entry type, so no extra stat() here
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in SKIP_DIRS:
+                        stack.append(entry.path)
+                elif entry.name.endswith(".py"):
+                    yield entry.path
+
+
+def _open_cache(db_path):
+    """Open (or create) the persistent content-hash -> vector cache"""
+    os.makedirs(db_path, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(db_path, CACHE_FILE))
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS emb_cache (hash BLOB PRIMARY KEY, vector BLOB)"
+    )
+    return conn
+
+
+def _chunk_hash(model_name, text):
+    """Key a chunk by (model, content) so switching models never reuses vectors"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(model_name.encode("utf-8"))
+    h.update(b"\0")
+    h.update(text.encode("utf-8"))
+    return h.digest()
+
+
+def _flush(engine, cache, pending, columns, vectors):
+    """Embed all buffered chunks in one batch and append them to the columns"""
+    if not pending:
+        return
+
+    model_id = f"{engine.model_name}@{engine.dimension}"
+    keys = [_chunk_hash(model_id, text) for _, text in pending]
+
+    # Reuse vectors for chunks we've already embedded on a previous run
+    unique_keys = list(set(keys))
+    placeholders = ",".join("?" * len(unique_keys))
+    cached = {
+        h: np.frombuffer(v, dtype=np.float32)
+        for h, v in cache.execute(
+            f"SELECT hash, vector FROM emb_cache WHERE hash IN ({placeholders})",
+            unique_keys,
+        )
+    }
+
+    # Only cache misses hit the GPU, and duplicate chunks (copy-pasted
+    # boilerplate) are embedded once; every duplicate still gets its own row
+    # with the shared vector so search returns all locations
+    misses = {}
+    for key, (_, text) in zip(keys, pending):
+        if key not in cached:
+            misses.setdefault(key, text)
+    if misses:
+        embedded = engine.get_embeddings(list(misses.values()))
+        for key, vector in zip(misses, embedded):
+            cached[key] = np.asarray(vector, dtype=np.float32)
+        cache.executemany(
+            "INSERT OR REPLACE INTO emb_cache (hash, vector) VALUES (?, ?)",
+            [(key, cached[key].tobytes()) for key in misses],
+        )
+        cache.commit()
+
+    for (meta, _), key in zip(pending, keys):
+        meta["hash"] = key.hex()
+        for name, column in columns.items():
+            column.append(meta[name])
+    # One (batch, dim) block per flush; stacked once when the table is built
+    vectors.append(np.stack([cached[key] for key in keys]).astype(VECTOR_DTYPE))
+    pending.clear()
+
+
+def _table_schema(dim):
+    """Arrow schema for the codebase table with a fixed-size vector column"""
+    return pa.schema([
+        pa.field("filename", pa.string()),
+        pa.field("path", pa.string()),
+        pa.field("symbol", pa.string()),
+        pa.field("text", pa.string()),
+        pa.field("hash", pa.string()),
+        pa.field("vector", pa.list_(pa.from_numpy_dtype(VECTOR_DTYPE), dim)),
+    ])
+
+
+def _chunk_file(builder, filepath):
+    """Read and parse one file into (row, chunk_text) tuples ready to embed"""
+    file = os.path.basename(filepath)
+    with open(filepath, "rb") as f:
+        content = f.read()
+    
+    # Extract Functions/Classes to chunk intelligently
+    symbols = builder.parse_symbols(content)
+    
+    # If no symbols, index whole file as one chunk
+    if not symbols:
+        if len(content.strip()) < MIN_CHUNK_BYTES:
+            return []
+        text = content.decode("utf-8", errors="replace")
+        return [({
+            "filename": file,
+            "path": filepath,
+            "symbol": "file",
+            "text": text,
+        }, text)]
+
+    # Index specific symbols
+    chunks = []
+    # Newline byte offsets padded with -1 and len(content), so line L (1-based)
+    # spans nl[L-1]+1 .. nl[L] and every chunk boundary is a single lookup
+    nl = np.concatenate((
+        [-1],
+        np.flatnonzero(np.frombuffer(content, dtype=np.uint8) == 10),
+        [len(content)],
+    ))
+    # Naive chunking: a fixed window of CHUNK_LINES lines from each symbol's
+    # def/class line, not the symbol's real extent
+    lines = np.fromiter((sym['line'] for sym in symbols), dtype=np.intp)
+    starts = (nl[lines - 1] + 1).tolist()
+    ends = nl[np.minimum(lines + CHUNK_LINES - 1, len(nl) - 1)].tolist()
+    for sym, start, end in zip(symbols, starts, ends):
+        raw = content[start:end]
+        if len(raw.strip()) < MIN_CHUNK_BYTES:
+            continue
+        chunk = raw.decode("utf-8", errors="replace")
+        
+        chunks.append(({
+            "filename": file,
+            "path": filepath,
+            "symbol": sym['name'],
+            "text": chunk,
+        }, chunk))
+    return chunks
+
+
+def _produce(builder, root, out, errors):
+    """Reader side of the pipeline: fill out with chunks, then a None sentinel"""
+    try:
+        with ThreadPoolExecutor(max_workers=READ_WORKERS) as pool:
+            # pool.map would submit every file up front; keep a bounded window
+            # in flight instead and hand results on in walk order
+            in_flight = deque()
+            for filepath in _iter_py(root):
+                in_flight.append(pool.submit(_chunk_file, builder, filepath))
+                if len(in_flight) >= READ_AHEAD:
+                    for item in in_flight.popleft().result():
+                        out.put(item)
+            while in_flight:
+                for item in in_flight.popleft().result():
+                    out.put(item)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        out.put(None)
+
+
+def _build_table(columns, vectors):
+    """Assemble the codebase Arrow table column-wise, with no per-row conversion"""
+    matrix = np.concatenate(vectors)
+    dim = matrix.shape[1]
+    vector_col = pa.FixedSizeListArray.from_arrays(pa.array(matrix.ravel()), dim)
+    return pa.table({**columns, "vector": vector_col}, schema=_table_schema(dim))
+
+
+def _create_vector_index(tbl, count):
+    """Pick and build the ANN index for the table based on its row count"""
+    if count < FLAT_SEARCH_MAX:
+        print(
+            f"  → Dataset small (<{FLAT_SEARCH_MAX}), "
+            "using high-precision Flat Search (No Index needed)."
+        )
+        return
+
+    # ~sqrt(N) partitions keeps both k-means training and per-query probing balanced
+    num_partitions = max(1, math.isqrt(count))
+    if count <= HNSW_MAX:
+        print("  → Optimizing Vector Index (IVF-HNSW-SQ)...")
+        tbl.create_index(
+            metric="cosine",
+            index_type="IVF_HNSW_SQ",
+            num_partitions=num_partitions,
+            accelerator=INDEX_ACCELERATOR,
+        )
+    else:
+        print("  → Optimizing Vector Index (IVF-PQ)...")
+        # 16 sub-vectors of 16 dims each for the default 256-D embeddings
+        tbl.create_index(
+            metric="cosine",
+            index_type="IVF_PQ",
+            num_partitions=num_partitions,
+            num_sub_vectors=16,
+            accelerator=INDEX_ACCELERATOR,
+        )
+
 
 def index_codebase():
     print(f"🚀 DREAMS AI: Starting M2 Matrix Indexing on {TARGET_DIR}...")
@@ -17,74 +248,55 @@ def index_codebase():
     
     # 2. Connect to Local DB
     db = lancedb.connect(DB_PATH)
+    cache = _open_cache(DB_PATH)
     
-    # Define Schema: filename, symbol_name, code_snippet, vector
-    data = []
+    # Define Schema: filename, symbol_name, code_snippet, hash, vector
+    columns = {name: [] for name in ("filename", "path", "symbol", "text", "hash")}
+    vectors = []
+    # (row, chunk_text) tuples waiting for the next batched embed
+    pending = []
     
     # 3. Walk and Crunch
     start_time = time.time()
     count = 0
     
-    for root, _, files in os.walk(TARGET_DIR):
-        if "venv" in root or "__pycache__" in root or ".git" in root:
-            continue
-            
-        for file in files:
-            if not file.endswith(".py"): continue
-            
-            filepath = os.path.join(root, file)
-            with open(filepath, "r", encoding="utf-8") as f:
-                content = f.read()
-            
-            # Extract Functions/Classes to chunk intelligently
-            symbols = builder.parse_symbols(content)
-            
-            # If no symbols, index whole file as one chunk
-            if not symbols:
-                vector = engine.get_embedding(content)
-                data.append({
-                    "filename": file,
-                    "path": filepath,
-                    "symbol": "file",
-                    "text": content,
-                    "vector": vector
-                })
-                count += 1
-                continue
-
-            # Index specific symbols
-            lines = content.split('\n')
-            for sym in symbols:
-                # Naive chunking: grab line number to line number + 20 (or until next symbol)
-                # For robust chunking, you'd use exact byte ranges, but this works for v1
-                s_line = sym['line'] - 1
-                chunk = "\n".join(lines[s_line:s_line+30]) # Capture ~30 lines of context
-                
-                vector = engine.get_embedding(chunk)
-                data.append({
-                    "filename": file,
-                    "path": filepath,
-                    "symbol": sym['name'],
-                    "text": chunk,
-                    "vector": vector
-                })
-                print(f"  → Embedded {sym['type']}: {sym['name']}")
-                count += 1
+    # Reader threads parse files into a bounded queue while this thread, the only
+    # one touching the GPU and the cache, drains it in batches
+    chunks = queue.Queue(maxsize=QUEUE_SIZE)
+    errors = []
+    producer = threading.Thread(
+        target=_produce, args=(builder, TARGET_DIR, chunks, errors), daemon=True
+    )
+    producer.start()
+
+    while (item := chunks.get()) is not None:
+        print(f"  → Queued {item[0]['symbol']}")
+        pending.append(item)
+        count += 1
+        # Full batch, or readers are behind and there's enough to keep the GPU busy
+        if len(pending) >= EMBED_BATCH_SIZE or (
+            len(pending) >= EMBED_MIN_BATCH and chunks.empty()
+        ):
+            _flush(engine, cache, pending, columns, vectors)
+
+    producer.join()
+    if errors:
+        raise errors[0]
+
+    # Embed whatever is left in the buffer
+    _flush(engine, cache, pending, columns, vectors)
+    cache.close()
 
     # 4. Save to Disk
-        # 4. Save to Disk
-    if data:
+    if vectors:
         # Create or Overwrite table
-        tbl = db.create_table("codebase", data, mode="overwrite")
+        tbl = db.create_table(
+            "codebase", _build_table(columns, vectors), mode="overwrite"
+        )
         elapsed = time.time() - start_time
         print(f"✅ Indexed {count} symbols in {elapsed:.2f}s using Metal GPU.")
         
-        # Only train index if we have enough data (requires >256 vectors)
-        if count > 256:
-            print("  → Optimizing Vector Index (IVF-PQ)...")
-            tbl.create_index(metric="cosine")
-        else:
-            print("  → Dataset small (<256), using high-precision Flat Search (No Index needed).")
+        _create_vector_index(tbl, count)
 
 
 if __name__ == "__main__":
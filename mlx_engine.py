@@ -1,26 +1,51 @@
-import mlx.core as mx
-# We use sentence_transformers because it handles the specific Nomic architecture 
-# better than raw MLX wrappers right now, but we run it on Metal.
-from sentence_transformers import SentenceTransformer
+import numpy as np
+# mlx_embedding_models ships a pure-MLX port of the Nomic BERT architecture,
+# so weights live in unified memory and the forward pass never touches Torch.
+from mlx_embedding_models.embedding import EmbeddingModel
+
+MAX_TOKENS = 511
 
 class DreamsMLXEngine:
-    def __init__(self, model_path="nomic-ai/nomic-embed-text-v1.5"):
+    def __init__(self, model_name="nomic-text-v1.5", dimension=256):
         print(f"🚀 Initializing Nomic Embed on M2 Max...")
-        # trust_remote_code=True is required for Nomic 1.5
-        self.model = SentenceTransformer(model_path, trust_remote_code=True, device="mps")
+        # Registry entry maps to nomic-ai/nomic-embed-text-v1.5 with mean pooling,
+        # then layer norm and L2 normalization (the layer norm is an extra step over
+        # sentence-transformers' Pooling -> Normalize, so vectors differ slightly)
+        self.model_name = model_name
+        # Nomic v1.5 is Matryoshka-trained: after layer norm, any prefix of the
+        # 768-D output re-normalized is a valid embedding
+        self.dimension = dimension
+        self.model = EmbeddingModel.from_registry(model_name)
+        # encode() pads to the smallest bucket in SEQ_LENS longer than the batch,
+        # and those buckets stop at 512, so inputs must truncate below that
+        self.model.max_length = MAX_TOKENS
         
     def get_embedding(self, text):
-        """Generate embedding on Metal GPU (MPS)"""
+        """Generate embedding on Metal GPU (MLX)"""
         # Nomic specific prefix
         prefixed_text = f"search_document: {text}"
         
-        # The library handles the Metal (MPS) offloading automatically when device="mps"
-        embedding = self.model.encode(prefixed_text, convert_to_numpy=True)
+        # Forward pass and pooling run as one MLX graph, evaluated on Metal
+        embedding = self.model.encode(
+            [prefixed_text], show_progress=False, dimension=self.dimension
+        )[0]
         
         return embedding
 
+    def get_embeddings(self, texts: list[str]) -> np.ndarray:
+        """Generate embeddings for a batch of texts in one Metal GPU pass"""
+        # Prefix once here so callers can pass raw chunks
+        prefixed = ["search_document: " + t for t in texts]
+
+        # encode() buckets batches by sequence length, so padding stays small
+        return self.model.encode(
+            prefixed, batch_size=64, show_progress=False, dimension=self.dimension
+        )
+
 if __name__ == "__main__":
     engine = DreamsMLXEngine()
     v = engine.get_embedding("Hello Dreams AI")
     print(f"✅ GPU Vector Generated (Dim: {len(v)})")
-
+    # Inputs far past the token limit must truncate, not fail
+    v = engine.get_embedding("def f(x): return x\n" * 2000)
+    print(f"✅ Long input truncated (Dim: {len(v)})")
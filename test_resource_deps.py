@@ -4,10 +4,9 @@ Test script for resource dependency mapping in SymbolGraphBuilder
 """
 
 from graph_builder import SymbolGraphBuilder
-import networkx as nx
 
 # Sample Python code with resource dependencies
-sample_code = """
+sample_code = '''
 import os
 import sqlite3
 import requests
@@ -58,7 +57,7 @@ def main():
 
 if __name__ == "__main__":
     main()
-"""
+'''
 
 def test_resource_dependencies():
     """Test the resource dependency mapping functionality"""
@@ -145,7 +144,7 @@ def test_resource_dependencies():
     # Calculate centrality measures
     if G.number_of_nodes() > 0:
         # Betweenness centrality (find critical nodes)
-        betweenness = nx.betweenness_centrality(G)
+        betweenness = builder.betweenness_centrality(G)
         top_betweenness = sorted(betweenness.items(), key=lambda x: x[1], reverse=True)[:3]
         
         print("\nTop 3 nodes by betweenness centrality (critical in dependency flow):")
@@ -157,5 +156,29 @@ def test_resource_dependencies():
     print("Resource dependency mapping test completed successfully!")
     print("=" * 60)
 
+def test_incremental_parse():
+    """Incremental tree-sitter reparses must match a fresh parse"""
+    print("\n" + "=" * 60)
+    print("Testing incremental tree-sitter parsing")
+    print("=" * 60)
+
+    builder = SymbolGraphBuilder(use_treesitter=True)
+    path = "sample.py"
+    old_code = sample_code.encode("utf8")
+    new_code = old_code.replace(
+        b"def read_config(", b"def renamed_config(x):\n    pass\n\ndef read_config("
+    )
+
+    first = builder._parse_tree(old_code, path)
+    assert builder._parse_tree(old_code, path) is first, "unchanged file was reparsed"
+    print("Unchanged content reuses the cached tree")
+
+    incremental = builder.parse_symbols(new_code, path, old_code)
+    fresh = SymbolGraphBuilder(use_treesitter=True).parse_symbols(new_code)
+    assert incremental == fresh, "incremental parse differs from a fresh parse"
+    assert any(s["name"] == "renamed_config" for s in incremental)
+    print(f"Incremental parse matches a fresh parse ({len(fresh)} symbols)")
+
 if __name__ == "__main__":
-    test_resource_dependencies()
\ No newline at end of file
+    test_resource_dependencies()
+    test_incremental_parse()
\ No newline at end of file